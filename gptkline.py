@@ -2,117 +2,304 @@ import yfinance as yf
 import pandas as pd
 import numpy as np
 import streamlit as st
-import matplotlib.pyplot as plt
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
-# Optional candlestick (if installed)
+# Optional candlestick：matplotlib / mplfinance 載入較慢，且只有勾選 K 線圖時才用到，
+# 改在第一次需要時才 import（未安裝回傳 None）；以 st.cache_resource 跨重跑保留結果，不會每次重跑都重試
+@st.cache_resource(show_spinner=False)
+def _load_mpf():
+    try:
+        import matplotlib
+        matplotlib.use('Agg')  # 只需輸出圖片給 st.pyplot，不需互動式 backend
+        import mplfinance as mpf
+    except Exception:
+        return None
+    return mpf
+
+# Optional pyarrow CSV writer（streamlit 依賴，通常已安裝）
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    HAS_ARROW = True
+except Exception:
+    HAS_ARROW = False
+
+# Optional Numba JIT（未安裝時退回純 Python 迴圈，結果相同）
 try:
-    import mplfinance as mpf
-    HAS_MPF = True
+    from numba import njit, types
+    HAS_NUMBA = True
 except Exception:
-    HAS_MPF = False
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+# 核心 kernel 的明確簽章 → import 時即編譯（cache=True 另寫入磁碟），使用者第一次按下按鈕不必等 JIT
+# 輸入宣告為唯讀陣列：pandas（Copy-on-Write）交出的陣列可能唯讀，可寫陣列也能直接傳入
+if HAS_NUMBA:
+    _F8_RO = types.Array(types.float64, 1, 'A', readonly=True)
+    _SIG_COMPUTE_ALL = types.float64[:, :](_F8_RO)
+    _SIG_CANDLE_CODES = types.UniTuple(types.int64[:], 2)(_F8_RO, _F8_RO, _F8_RO, _F8_RO)
+else:
+    _SIG_COMPUTE_ALL = _SIG_CANDLE_CODES = None
 
 st.set_page_config(page_title="自動日報表 (K線 + 技術解讀)", layout="wide")
 
 # ----------------- helper functions -----------------
-@st.cache_data(ttl=60*30)
-def download_data(ticker: str, period: str = "6mo", interval: str = "1d"):
-    """下載資料並做基本清理"""
-    df = yf.download(ticker, period=period, interval=interval, progress=False, threads=False)
+def cache_bucket(seconds: int = 60*30) -> int:
+    """目前時間所屬的快取時段編號（每 seconds 秒換一次）"""
+    return int(datetime.now().timestamp() // seconds)
+
+def _fetch_history(yf_ticker, period: str, interval: str):
+    """下載單一代號歷史資料並做基本清理"""
+    # auto_adjust=False 以保留 'Adj Close' 欄位（與 yf.download 行為一致）
+    df = yf_ticker.history(period=period, interval=interval, auto_adjust=False)
     if df.empty:
         return df
-    # 處理 MultiIndex columns（近期 yfinance 版本對單一 ticker 也使用 MultiIndex）
-    if isinstance(df.columns, pd.MultiIndex):
-        df.columns = df.columns.droplevel(1)  # 移除 ticker 層級，保留屬性如 'Open', 'Close'
+    df = df.drop(columns=['Dividends', 'Stock Splits', 'Capital Gains'], errors='ignore')
+    # 只以 Close 判斷缺值列；Adj Close 個別缺值時退回 Close，不整列丟棄
+    mask = ~np.isnan(df['Close'].to_numpy(dtype=np.float64))
+    if not mask.all():
+        df = df.iloc[mask].copy()
     # 優先使用 Adjusted Close 做指標計算（若有）
     if 'Adj Close' in df.columns:
-        df['Close_for_calc'] = df['Adj Close']
+        df['Close_for_calc'] = df['Adj Close'].fillna(df['Close'])
     else:
         df['Close_for_calc'] = df['Close']
-    df.dropna(inplace=True)
     return df
 
-def compute_indicators(df: pd.DataFrame):
-    c = df['Close_for_calc']
-    df['EMA10'] = c.ewm(span=10, adjust=False).mean()
-    df['EMA30'] = c.ewm(span=30, adjust=False).mean()
-    df['EMA40'] = c.ewm(span=40, adjust=False).mean()
-
-    # MACD (DIF, DEA, MACD hist)
-    exp12 = c.ewm(span=12, adjust=False).mean()
-    exp26 = c.ewm(span=26, adjust=False).mean()
-    df['DIF'] = exp12 - exp26
-    df['DEA'] = df['DIF'].ewm(span=9, adjust=False).mean()
-    df['MACD_hist'] = df['DIF'] - df['DEA']  # positive => 多方動能
-
-    # RSI (14日)
-    delta = c.diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-    rs = gain / loss
-    df['RSI'] = 100 - (100 / (1 + rs))
-
-    # 成交量平均
-    df['VOL_MA20'] = df['Volume'].rolling(window=20, min_periods=1).mean()
-    return df
-
-def classify_candle(o, h, l, c):
-    """簡單分類K線：大陽、小陽、十字、長上影、長下影、長紅長黑等"""
-    body = abs(c - o)
-    full = h - l + 1e-9
-    upper = h - max(c, o)
-    lower = min(c, o) - l
-    body_ratio = body / full if full > 0 else 0
-
-    if body_ratio < 0.15:
-        typ = "十字/小實體（盤整）"
-    else:
-        if c > o:
-            typ = "陽線（紅K）"
+@st.cache_data(ttl=60*30, max_entries=256, show_spinner=False)
+def download_data(ticker: str, period: str = "6mo", interval: str = "1d"):
+    """下載資料並做基本清理（記憶體快取 30 分鐘）"""
+    return _fetch_history(yf.Ticker(ticker), period, interval)
+
+def download_data_batch(tickers, period: str = "6mo", interval: str = "1d", max_workers: int = 8):
+    """多檔代號並行下載（網路 I/O 會釋放 GIL），回傳 {代號: DataFrame}；下載失敗者發出警告並略過"""
+    # 每個代號各自一個 Ticker，工作執行緒之間不共用物件
+    yf_tickers = {t: yf.Ticker(t) for t in tickers}
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(yf_tickers)))) as ex:
+        futures = {t: ex.submit(_fetch_history, yt, period, interval) for t, yt in yf_tickers.items()}
+        for t, fut in futures.items():
+            try:
+                results[t] = fut.result()
+            except Exception as e:
+                warnings.warn(f"{t} 下載失敗：{e}")
+    return results
+
+# EMA 平滑係數 alpha = 2/(span+1)；模組常數在 JIT 編譯時會被折疊成常數
+_A10, _A30, _A40 = 2 / 11, 2 / 31, 2 / 41  # EMA10/30/40
+_A12, _A26, _A9 = 2 / 13, 2 / 27, 2 / 10   # MACD 12/26/9
+_RSI_N = 14
+_A_RSI = 1 / _RSI_N                          # RSI Wilder 平滑
+
+@njit(_SIG_COMPUTE_ALL, cache=True)
+def _compute_all(c):
+    """單次掃描算出 EMA10/30/40、DIF、DEA、MACD_hist（等同 ewm(adjust=False)）與 Wilder RSI"""
+    n = c.shape[0]
+    out = np.empty((7, n))
+    if n == 0:
+        return out
+    e10 = e30 = e40 = e12 = e26 = c[0]
+    dea = 0.0
+    avg_gain = avg_loss = 0.0
+    out[0, 0] = e10
+    out[1, 0] = e30
+    out[2, 0] = e40
+    out[3, 0] = 0.0
+    out[4, 0] = 0.0
+    out[5, 0] = 0.0
+    out[6, 0] = np.nan
+    for i in range(1, n):
+        x = c[i]
+        e10 = _A10 * x + (1 - _A10) * e10
+        e30 = _A30 * x + (1 - _A30) * e30
+        e40 = _A40 * x + (1 - _A40) * e40
+        e12 = _A12 * x + (1 - _A12) * e12
+        e26 = _A26 * x + (1 - _A26) * e26
+        dif = e12 - e26
+        dea = _A9 * dif + (1 - _A9) * dea
+        out[0, i] = e10
+        out[1, i] = e30
+        out[2, i] = e40
+        out[3, i] = dif
+        out[4, i] = dea
+        out[5, i] = dif - dea
+
+        # RSI：前 14 個價差的簡單平均作為起點（同 TA-Lib），之後以 Wilder 遞迴平滑
+        d = x - c[i - 1]
+        gain = d if d > 0 else 0.0
+        loss = -d if d < 0 else 0.0
+        if i <= _RSI_N:
+            avg_gain += gain
+            avg_loss += loss
+            if i == _RSI_N:
+                avg_gain /= _RSI_N
+                avg_loss /= _RSI_N
         else:
-            typ = "陰線（綠K）"
-
-    # 影線判別
-    if lower > body * 2 and lower > upper:
-        typ += "，長下影（可能支撐或吸籌）"
-    elif upper > body * 2 and upper > lower:
-        typ += "，長上影（可能壓力或獲利了結）"
-    elif body_ratio > 0.7:
-        typ += "，實體長（趨勢強烈）"
-
-    return typ
+            avg_gain = _A_RSI * gain + (1 - _A_RSI) * avg_gain
+            avg_loss = _A_RSI * loss + (1 - _A_RSI) * avg_loss
+        if i < _RSI_N:
+            out[6, i] = np.nan
+        elif avg_loss > 0:
+            out[6, i] = 100 - 100 / (1 + avg_gain / avg_loss)
+        elif avg_gain > 0:
+            out[6, i] = 100.0  # 無下跌
+        else:
+            out[6, i] = np.nan
+    return out
+
+def _ema_conv(x, alpha, init=None, tol=1e-12):
+    """EMA 的閉式卷積形式：y_t = Σ α(1-α)^k·x_{t-k} + (1-α)^(t+1)·y_{-1}，y_{-1} = init（預設 x_0），核截斷至權重 < tol"""
+    n = x.shape[0]
+    if n == 0:
+        return np.empty(0)
+    phi = 1 - alpha
+    k = min(n, int(np.ceil(np.log(tol / alpha) / np.log(phi))) + 1)
+    kernel = alpha * phi ** np.arange(k)
+    y = np.convolve(x, kernel)[:n]
+    y += phi ** np.arange(1, n + 1) * (x[0] if init is None else init)
+    return y
+
+def _wilder(x, n):
+    """Wilder 平滑：第 n 筆為前 n 筆簡單平均，之後 y_t = y_{t-1} + (x_t - y_{t-1}) / n；前 n-1 筆為 NaN"""
+    y = np.full(x.shape[0], np.nan)
+    if x.shape[0] < n:
+        return y
+    seed = x[:n].mean()
+    y[n - 1] = seed
+    y[n:] = _ema_conv(x[n:], 1 / n, init=seed)
+    return y
+
+def _compute_all_vec(c):
+    """與 _compute_all 相同輸出，但以卷積向量化計算（未安裝 Numba 時使用）"""
+    dif = _ema_conv(c, _A12) - _ema_conv(c, _A26)
+    dea = _ema_conv(dif, _A9)
+    d = np.diff(c)
+    rsi = np.full(c.shape[0], np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = _wilder(np.maximum(d, 0), _RSI_N) / _wilder(np.maximum(-d, 0), _RSI_N)  # 無下跌時 rs=inf → RSI=100
+    rsi[1:] = 100 - (100 / (1 + rs))
+    return np.vstack([_ema_conv(c, _A10), _ema_conv(c, _A30), _ema_conv(c, _A40), dif, dea, dif - dea, rsi])
 
-def single_candle_interpret(row, ema10, ema30, vol_ma20, rsi):
-    o, h, l, c, v = row['Open'], row['High'], row['Low'], row['Close_for_calc'], row['Volume']
-    typ = classify_candle(o, h, l, c)
+def compute_indicators(df: pd.DataFrame):
+    # EMA、MACD (DIF, DEA, MACD hist) 與 RSI (14日，Wilder) 一次掃描算完
+    kernel = _compute_all if HAS_NUMBA else _compute_all_vec
+    ema10, ema30, ema40, dif, dea, macd_hist, rsi = kernel(df['Close_for_calc'].to_numpy(dtype=np.float64))
+
+    # 一次 assign 所有指標欄位，避免逐欄插入觸發多次 block 重整
+    # 20日均量只有報表尾段會用到，改由 vol_ma20_tail 在取尾段時計算
+    return df.assign(EMA10=ema10, EMA30=ema30, EMA40=ema40,
+                     DIF=dif, DEA=dea, MACD_hist=macd_hist,  # MACD_hist positive => 多方動能
+                     RSI=rsi)
+
+def vol_ma20_tail(volume, n=20):
+    """最後 n 根的 20 日均量（前 19 根以現有筆數平均，同 rolling(min_periods=1)）；只取最後 n+19 筆成交量，以累積和相減求窗內總量"""
+    v = np.asarray(volume, dtype=np.float64)[-(n + 19):]
+    cs = np.concatenate(([0.0], np.cumsum(v)))
+    hi = np.arange(max(len(v) - n, 0) + 1, len(v) + 1)
+    lo = np.maximum(hi - 20, 0)
+    return (cs[hi] - cs[lo]) / (hi - lo)
+
+@st.cache_data(ttl=60*30, max_entries=64, show_spinner=False)
+def load_indicators(ticker: str, period: str = "6mo", interval: str = "1d"):
+    """下載並計算指標；以 (ticker, period, interval) 快取 30 分鐘，重跑時不必重算"""
+    df = download_data(ticker, period=period, interval=interval)
+    if df.empty:
+        return df
+    return compute_indicators(df)
+
+_CANDLE_TYPES = np.array(["十字/小實體（盤整）", "陽線（紅K）", "陰線（綠K）"])
+_CANDLE_SHADOWS = np.array(["", "，長下影（可能支撐或吸籌）", "，長上影（可能壓力或獲利了結）", "，實體長（趨勢強烈）"])
+
+@njit(_SIG_CANDLE_CODES, cache=True)
+def _candle_codes(o, h, l, c):
+    """逐根回傳 (實體型態碼, 影線型態碼)，對應 _CANDLE_TYPES / _CANDLE_SHADOWS"""
+    n = o.shape[0]
+    typ = np.empty(n, dtype=np.int64)
+    shadow = np.empty(n, dtype=np.int64)
+    for i in range(n):
+        body = abs(c[i] - o[i])
+        full = h[i] - l[i] + 1e-9
+        upper = h[i] - max(c[i], o[i])
+        lower = min(c[i], o[i]) - l[i]
+        body_ratio = body / full if full > 0 else 0.0
+
+        if body_ratio < 0.15:
+            typ[i] = 0
+        elif c[i] > o[i]:
+            typ[i] = 1
+        else:
+            typ[i] = 2
+
+        # 影線判別
+        if lower > body * 2 and lower > upper:
+            shadow[i] = 1
+        elif upper > body * 2 and upper > lower:
+            shadow[i] = 2
+        elif body_ratio > 0.7:
+            shadow[i] = 3
+        else:
+            shadow[i] = 0
+    return typ, shadow
+
+# RSI / 價位分級：以門檻查表得到 0/1/2 代碼，再用代碼索引文字表，不需逐列 if/elif
+# RSI<30 → 0（超賣）；30–70 → 1（中性，含 70）；>70 → 2（超買）
+_RSI_BINS = np.array([30.0, np.nextafter(70.0, np.inf)])
+_CANDLE_RSI = np.array(["超賣<30，潛在反彈", "中性50附近", "超買>70，需防回檔"])
+_CANDLE_POS = np.array(["收在 EMA10 之上（短線偏多）", "跌破 EMA10 但守住 EMA30（短線整理）", "跌破 EMA30（短期偏弱）"])
+
+def rsi_codes(rsi):
+    """RSI 分級代碼；NaN（資料不足）視為中性"""
+    rsi = np.asarray(rsi, dtype=np.float64)
+    return np.where(np.isnan(rsi), 1, np.searchsorted(_RSI_BINS, rsi, side='right'))
+
+def position_codes(c, ema10, ema30):
+    """收盤相對均線代碼：0 在 EMA10 之上，1 介於 EMA10 與 EMA30，2 跌破 EMA30"""
+    return 2 - np.maximum(2 * np.greater(c, ema10), np.greater(c, ema30))
+
+def classify_candles(o, h, l, c):
+    """簡單分類K線（向量化）：大陽、小陽、十字、長上影、長下影、長紅長黑等"""
+    typ, shadow = _candle_codes(o, h, l, c)
+    return np.char.add(_CANDLE_TYPES[typ], _CANDLE_SHADOWS[shadow])
+
+def candle_interpretations(o, h, l, c, v, ema10, ema30, vol_ma20, rsi):
+    """逐根解讀（向量化）：K線型態、價位相對均線、量能、RSI"""
+    typ = classify_candles(o, h, l, c)
     # 價位相對均線
-    if c > ema10:
-        pos = "收在 EMA10 之上（短線偏多）"
-    elif c > ema30:
-        pos = "跌破 EMA10 但守住 EMA30（短線整理）"
-    else:
-        pos = "跌破 EMA30（短期偏弱）"
+    pos = _CANDLE_POS[position_codes(c, ema10, ema30)]
     # 量能
-    if np.isnan(vol_ma20) or vol_ma20 == 0:
-        vol_note = "成交量資料不足"
-    else:
-        ratio = v / vol_ma20
-        if ratio > 1.5:
-            vol_note = f"量大（{ratio:.2f}x 近20日均量）"
-        elif ratio < 0.7:
-            vol_note = f"量縮（{ratio:.2f}x 近20日均量）"
-        else:
-            vol_note = f"量正常（{ratio:.2f}x 近20日均量）"
+    valid = ~np.isnan(vol_ma20) & (vol_ma20 != 0)
+    ratio = np.where(valid, v / np.where(valid, vol_ma20, 1.0), np.nan)
+    vol_label = np.select([~valid, ratio > 1.5, ratio < 0.7], ["", "量大", "量縮"], default="量正常")
+    vol_note = [f"{lab}（{r:.2f}x 近20日均量）" if lab else "成交量資料不足"
+                for lab, r in zip(vol_label, ratio)]
     # RSI 補充
-    rsi_note = f"RSI={rsi:.1f}（" + ("超買>70，需防回檔" if rsi > 70 else "超賣<30，潛在反彈" if rsi < 30 else "中性50附近") + "）"
-    return f"{typ}；{pos}；{vol_note}；{rsi_note}"
-
-def overall_trend_text(df):
-    last = df.iloc[-1]
-    ema10, ema30, ema40 = last['EMA10'], last['EMA30'], last['EMA40']
+    rsi_label = _CANDLE_RSI[rsi_codes(rsi)]
+    return [f"{t}；{p}；{vn}；RSI={r:.1f}（{rl}）"
+            for t, p, vn, r, rl in zip(typ, pos, vol_note, rsi, rsi_label)]
+
+# 報表只讀取最後幾根的數值：一次切出尾段 numpy 陣列，各段共用，不再逐一 .iloc 取值
+_TAIL_COLS = ['Open', 'High', 'Low', 'Close_for_calc', 'Volume',
+              'EMA10', 'EMA30', 'EMA40', 'DIF', 'DEA', 'MACD_hist', 'RSI']
+
+def tail_arrays(df, n=20):
+    """取最後 n 根的指標欄位與 20 日均量，回傳 {欄位: numpy 陣列}"""
+    tail = df[_TAIL_COLS].iloc[-n:].to_numpy(dtype=np.float64)
+    out = dict(zip(_TAIL_COLS, tail.T))
+    out['VOL_MA20'] = vol_ma20_tail(df['Volume'].to_numpy(), n)
+    return out
+
+def overall_trend_text(tail):
+    e10, e30, e40 = tail['EMA10'], tail['EMA30'], tail['EMA40']
+    ema10, ema30, ema40 = e10[-1], e30[-1], e40[-1]
     # slope 判斷：比較最近 5 天的 EMA10 與 5 天前
-    slope10 = ema10 - df['EMA10'].iloc[-5] if len(df) >= 6 else ema10 - df['EMA10'].iloc[0]
-    slope30 = ema30 - df['EMA30'].iloc[-5] if len(df) >= 6 else ema30 - df['EMA30'].iloc[0]
+    slope10 = ema10 - e10[-5] if len(e10) >= 6 else ema10 - e10[0]
+    slope30 = ema30 - e30[-5] if len(e30) >= 6 else ema30 - e30[0]
     trend = ""
     if ema10 > ema30 > ema40 and slope10 > 0 and slope30 > 0:
         trend = "中期趨勢仍偏多（均線多頭排列且向上）"
@@ -122,48 +309,47 @@ def overall_trend_text(df):
         trend = "趨勢分歧或整理（需關注均線與量能）"
     return trend
 
-def macd_status(df):
+def macd_status(tail):
     # 判斷 DIF 與 DEA 的最近變化
-    dif = df['DIF'].iloc[-1]
-    dea = df['DEA'].iloc[-1]
-    hist = df['MACD_hist'].iloc[-1]
-    hist_trend = "上升" if (df['MACD_hist'].iloc[-1] > df['MACD_hist'].iloc[-3] if len(df)>=3 else df['MACD_hist'].iloc[-1]>0) else "下降或收斂"
+    difs, deas, hists = tail['DIF'], tail['DEA'], tail['MACD_hist']
+    dif, dea, hist = difs[-1], deas[-1], hists[-1]
+    hist_trend = "上升" if (hist > hists[-3] if len(hists)>=3 else hist>0) else "下降或收斂"
     cross = ""
-    if len(df) >= 2:
-        if dif > dea and df['DIF'].iloc[-2] <= df['DEA'].iloc[-2]:
+    if len(difs) >= 2:
+        if dif > dea and difs[-2] <= deas[-2]:
             cross = "（近期出現 MACD 黃金交叉）"
-        elif dif < dea and df['DIF'].iloc[-2] >= df['DEA'].iloc[-2]:
+        elif dif < dea and difs[-2] >= deas[-2]:
             cross = "（近期出現 MACD 死亡交叉）"
     return f"DIF={dif:.3f}, DEA={dea:.3f}, MACD_hist={hist:.3f}；柱狀態趨勢：{hist_trend} {cross}"
 
+_RSI_STATUS = ("RSI<30（超賣，潛在反彈機會）", "RSI={:.1f}（中性，無明顯極端）", "RSI>70（超買，短期有回檔風險）")
+
 def rsi_status(last_rsi):
-    if last_rsi > 70:
-        return "RSI>70（超買，短期有回檔風險）"
-    elif last_rsi < 30:
-        return "RSI<30（超賣，潛在反彈機會）"
-    else:
-        return f"RSI={last_rsi:.1f}（中性，無明顯極端）"
+    return _RSI_STATUS[rsi_codes(last_rsi)].format(last_rsi)
 
-def historical_context(df):
-    """分析前因：最近10日趨勢變化、關鍵高低點"""
-    if len(df) < 10:
+_PRICE_POS = ("收在 EMA10 之上", "收在 EMA10 與 EMA30 之間", "已跌破 EMA30")
+
+def historical_context(tail, dates):
+    """分析前因：最近10日趨勢變化、關鍵高低點（tail 為 tail_arrays 快照，dates 為最後 10 根已格式化的 'MM-DD' 日期字串）"""
+    closes, vols = tail['Close_for_calc'], tail['Volume']
+    if len(closes) < 10:
         return "資料不足，無法完整分析歷史脈絡。"
     
-    last10 = df.tail(10)
-    price_change_10d = (df['Close_for_calc'].iloc[-1] / df['Close_for_calc'].iloc[-10] - 1) * 100
-    vol_change_10d = (last10['Volume'].mean() / df['VOL_MA20'].iloc[-10] - 1) * 100 if not np.isnan(df['VOL_MA20'].iloc[-10]) else 0
+    price_change_10d = (closes[-1] / closes[-10] - 1) * 100
+    vol_ma20_10ago = tail['VOL_MA20'][-10]
+    vol_change_10d = (vols[-10:].mean() / vol_ma20_10ago - 1) * 100 if not np.isnan(vol_ma20_10ago) else 0
     
-    # 關鍵轉折點：最近10日內最大漲跌日
-    daily_returns = last10['Close_for_calc'].pct_change()
-    max_up_day = daily_returns.idxmax()
-    max_down_day = daily_returns.idxmin()
-    max_up_pct = daily_returns.max() * 100
-    max_down_pct = daily_returns.min() * 100
+    # 關鍵轉折點：最近10日內最大漲跌日（numpy 一次算報酬，再各做一次 argmax/argmin）
+    arr = closes[-10:]
+    rets = np.diff(arr) / arr[:-1]  # rets[k] 為 dates[k+1] 當日報酬
+    up_i, down_i = rets.argmax(), rets.argmin()
+    max_up_day, max_down_day = dates[up_i + 1], dates[down_i + 1]
+    max_up_pct, max_down_pct = rets[up_i] * 100, rets[down_i] * 100
     
     context = (
         f"**前10日脈絡：** 價格累計變動 {price_change_10d:+.1f}%，量能相對20日前均量變動 {vol_change_10d:+.1f}%。\n"
-        f"關鍵事件：{max_up_day.strftime('%m-%d')} 大漲{max_up_pct:+.1f}%（可能受利多消息或技術突破）；"
-        f"{max_down_day.strftime('%m-%d')} 大跌{max_down_pct:.1f}%（可能遇壓力或負面因素）。\n"
+        f"關鍵事件：{max_up_day} 大漲{max_up_pct:+.1f}%（可能受利多消息或技術突破）；"
+        f"{max_down_day} 大跌{max_down_pct:.1f}%（可能遇壓力或負面因素）。\n"
         "整體前因顯示：近期波動加劇，需留意是否延續上漲動能或轉入震盪。"
     )
     return context
@@ -190,11 +376,11 @@ def future_scenarios(df, last_rsi, macd_hist_trend, price_pos, vol_ratio):
     
     return "\n".join(scenarios)
 
-def important_levels(df):
-    last = df.iloc[-1]
-    ema10, ema30, ema40 = last['EMA10'], last['EMA30'], last['EMA40']
-    recent_high = df['High'].rolling(window=20, min_periods=1).max().iloc[-1]
-    recent_low  = df['Low'].rolling(window=20, min_periods=1).min().iloc[-1]
+def important_levels(tail):
+    ema10, ema30, ema40 = tail['EMA10'][-1], tail['EMA30'][-1], tail['EMA40'][-1]
+    # 只需最後 20 根的高低點，直接對尾段取 max/min，不必算整條 rolling
+    recent_high = float(tail['High'][-20:].max())
+    recent_low  = float(tail['Low'][-20:].min())
     return {
         "EMA10": ema10,
         "EMA30": ema30,
@@ -203,79 +389,97 @@ def important_levels(df):
         "recent_low_20": recent_low
     }
 
+# 報表文字模板：模組載入時建好一次，產生報表時只需 format_map 填值
+_VOL_NOTE_TEMPLATE = "當日量 {vol_now:.0f}，20日均量 {vol_ma20:.0f}（比率 {vol_ratio:.2f}x）".format_map
+_LEVELS_TEMPLATE = (
+    "EMA10={EMA10:.3f}，EMA30={EMA30:.3f}，EMA40={EMA40:.3f}。\n"
+    "最近20日高點 {recent_high_20:.2f}，低點 {recent_low_20:.2f}。"
+).format_map
+_COMPOSITE_TEMPLATE = (
+    "目前價格 {price_pos}；{macd_hint}。異動量能：{vol_note}。{rsi_note}\n"
+    "{hist_context}\n"
+    "未來情境觀察：\n{future_scen}\n"
+    "綜合來看：\n"
+    "- 中期趨勢：{quick}\n"
+    "- MACD 與動能狀態：{macd}\n"
+    "- 重要價位：{levels_text}\n"
+).format_map
+
+# concrete suggestions (更全面建議，整合前因後果)；內容固定，直接預先組好
+_ADVICE_TEXT = "\n".join(f"- {a}" for a in [
+    "**持有者建議：** 依前10日漲跌脈絡，若近期大漲後RSI超買，保守者減半倉位設停損於EMA30下方5%；積極者若MACD擴張，可持倉觀察突破近期高點。",
+    "**新多單進場：** 避免追高，等待回測EMA10/30並出現長下影+放量訊號（參考前因關鍵低點），或RSI回落至50以下再布局，目標上攻10%空間。",
+    "**短線/做空策略：** 若跌破EMA30且量放大（類似前因大跌日），可短空至EMA40或近期低點，停損設近期高點上方；RSI>70時為理想空點。",
+    "**風險控管與後果規避：** 控倉不超總資產10%，分批操作；監控未來情境，若中性盤整持續，轉為觀望；總原則：順勢而為，嚴守停損以防黑天鵝。"
+])
+
+def _frame_key(df: pd.DataFrame):
+    """快取用的輕量 DataFrame 鍵：筆數 + 最後時間戳 + 最後收盤，免去整張表內容雜湊"""
+    if df.empty:
+        return (0,)
+    return (len(df), df.index[-1].value, float(df['Close_for_calc'].iloc[-1]))
+
+@st.cache_data(ttl=60*30, max_entries=64, show_spinner=False, hash_funcs={pd.DataFrame: _frame_key})
 def generate_detailed_report(df, ticker):
     """組合最終詳細綜合解讀文字（中文）"""
-    last5 = df.tail(5)
-    last = df.iloc[-1]
-    last_rsi = last['RSI']
-    vol_ratio = last['Volume'] / last['VOL_MA20'] if not np.isnan(last['VOL_MA20']) else 1
+    tail = tail_arrays(df)
+    last_rsi = tail['RSI'][-1]
+    last_close = tail['Close_for_calc'][-1]
+    vol_now = tail['Volume'][-1]
+    vol_ma20 = tail['VOL_MA20'][-1]
+    vol_ratio = vol_now / vol_ma20 if not np.isnan(vol_ma20) else 1
 
     # quick conclusion
-    quick = overall_trend_text(df)
+    quick = overall_trend_text(tail)
 
     # indicators
-    macd = macd_status(df)
-    vol_now = last['Volume']
-    vol_ma20 = last['VOL_MA20']
-    vol_note = "量不足" if np.isnan(vol_ma20) else f"當日量 {vol_now:.0f}，20日均量 {vol_ma20:.0f}（比率 {vol_ratio:.2f}x）"
+    macd = macd_status(tail)
+    vol_note = "量不足" if np.isnan(vol_ma20) else _VOL_NOTE_TEMPLATE(
+        {"vol_now": vol_now, "vol_ma20": vol_ma20, "vol_ratio": vol_ratio})
     rsi_note = rsi_status(last_rsi)
 
     # per-candle table (新增RSI)
-    rows = []
-    for idx, row in last5.iterrows():
-        rows.append({
-            "日期": idx.strftime("%Y-%m-%d"),
-            "開": round(row['Open'],2),
-            "高": round(row['High'],2),
-            "低": round(row['Low'],2),
-            "收": round(row['Close_for_calc'],2),
-            "成交量": int(row['Volume']),
-            "RSI": f"{row['RSI']:.1f}",
-            "單根解讀": single_candle_interpret(row, row['EMA10'], row['EMA30'], row['VOL_MA20'], row['RSI'])
-        })
-    per_candle_df = pd.DataFrame(rows)
+    o, h, l, c, v, ema10_5, ema30_5, vol_ma20_5, rsi5 = (
+        tail[k][-5:] for k in ['Open','High','Low','Close_for_calc','Volume','EMA10','EMA30','VOL_MA20','RSI'])
+    per_candle_df = pd.DataFrame({
+        "日期": df.index[-5:].strftime("%Y-%m-%d"),
+        "開": np.round(o, 2),
+        "高": np.round(h, 2),
+        "低": np.round(l, 2),
+        "收": np.round(c, 2),
+        "成交量": v.astype(np.int64),
+        "RSI": [f"{r:.1f}" for r in rsi5],
+        "單根解讀": candle_interpretations(o, h, l, c, v, ema10_5, ema30_5, vol_ma20_5, rsi5)
+    })
 
     # important levels
-    lv = important_levels(df)
-    levels_text = (
-        f"EMA10={lv['EMA10']:.3f}，EMA30={lv['EMA30']:.3f}，EMA40={lv['EMA40']:.3f}。\n"
-        f"最近20日高點 {lv['recent_high_20']:.2f}，低點 {lv['recent_low_20']:.2f}。"
-    )
+    lv = important_levels(tail)
+    levels_text = _LEVELS_TEMPLATE(lv)
+
+    # 不足 20 根時走精簡路徑：20日均量、近期高低點與前因/情境判讀都不具參考性，直接略過
+    short_data = len(df) < 20
 
     # historical context (前因)
-    hist_context = historical_context(df)
+    hist_context = "資料不足 20 根，略過前因脈絡分析。" if short_data else historical_context(tail, df.index[-10:].strftime('%m-%d'))
 
     # future scenarios (後果)
-    macd_trend = "上升" if len(df) >= 3 and last['MACD_hist'] > df['MACD_hist'].iloc[-3] else "中性"
-    price_pos = ("收在 EMA10 之上" if last['Close_for_calc'] > lv['EMA10']
-                 else "收在 EMA10 與 EMA30 之間" if last['Close_for_calc'] > lv['EMA30']
-                 else "已跌破 EMA30")
-    future_scen = future_scenarios(df, last_rsi, macd_trend, price_pos, vol_ratio)
+    hist = tail['MACD_hist']
+    macd_hist_now = hist[-1]
+    macd_hist_3ago = hist[-3] if len(df) >= 3 else 0
+    macd_trend = "上升" if len(df) >= 3 and macd_hist_now > macd_hist_3ago else "中性"
+    price_pos = _PRICE_POS[position_codes(last_close, lv['EMA10'], lv['EMA30'])]
+    future_scen = ("資料不足，暫不推估未來情境。" if short_data
+                   else future_scenarios(df, last_rsi, macd_trend, price_pos, vol_ratio))
 
     # composite meaning
-    macd_hist_3ago = df['MACD_hist'].iloc[-3] if len(df) >= 3 else 0
-    macd_hint = "動能仍正但柱體縮小（需留意動能是否繼續衰竭）" if len(df) >= 3 and last['MACD_hist'] > 0 and last['MACD_hist'] < macd_hist_3ago else \
-               ("動能擴張（上攻續有機會）" if len(df) >= 3 and last['MACD_hist'] > macd_hist_3ago else "動能偏弱或收斂")
-
-    composite = (
-        f"目前價格 {price_pos}；{macd_hint}。異動量能：{vol_note}。{rsi_note}\n"
-        f"{hist_context}\n"
-        f"未來情境觀察：\n{future_scen}\n"
-        "綜合來看：\n"
-        "- 中期趨勢：" + quick + "\n"
-        f"- MACD 與動能狀態：{macd}\n"
-        f"- 重要價位：{levels_text}\n"
-    )
-
-    # concrete suggestions (更全面建議，整合前因後果)
-    advice = [
-        "**持有者建議：** 依前10日漲跌脈絡，若近期大漲後RSI超買，保守者減半倉位設停損於EMA30下方5%；積極者若MACD擴張，可持倉觀察突破近期高點。",
-        "**新多單進場：** 避免追高，等待回測EMA10/30並出現長下影+放量訊號（參考前因關鍵低點），或RSI回落至50以下再布局，目標上攻10%空間。",
-        "**短線/做空策略：** 若跌破EMA30且量放大（類似前因大跌日），可短空至EMA40或近期低點，停損設近期高點上方；RSI>70時為理想空點。",
-        "**風險控管與後果規避：** 控倉不超總資產10%，分批操作；監控未來情境，若中性盤整持續，轉為觀望；總原則：順勢而為，嚴守停損以防黑天鵝。"
-    ]
+    macd_hint = "動能仍正但柱體縮小（需留意動能是否繼續衰竭）" if len(df) >= 3 and macd_hist_now > 0 and macd_hist_now < macd_hist_3ago else \
+               ("動能擴張（上攻續有機會）" if len(df) >= 3 and macd_hist_now > macd_hist_3ago else "動能偏弱或收斂")
 
-    advice_text = "\n".join([f"- {a}" for a in advice])
+    composite = _COMPOSITE_TEMPLATE({
+        "price_pos": price_pos, "macd_hint": macd_hint, "vol_note": vol_note, "rsi_note": rsi_note,
+        "hist_context": hist_context, "future_scen": future_scen, "quick": quick,
+        "macd": macd, "levels_text": levels_text,
+    })
 
     # package
     report = {
@@ -286,9 +490,10 @@ def generate_detailed_report(df, ticker):
         "rsi_note": rsi_note,
         "levels_text": levels_text,
         "composite_text": composite,
-        "advice_text": advice_text,
+        "advice_text": _ADVICE_TEXT,
         "per_candle_df": per_candle_df,
-        "current_price": last['Close_for_calc'],
+        "per_candle_csv": to_csv_bytes(per_candle_df),  # 與報表一起快取，重跑時下載鈕不必重新編碼
+        "current_price": last_close,
         "ema10": lv['EMA10'],
         "ema30": lv['EMA30'],
         "ema40": lv['EMA40'],
@@ -384,6 +589,38 @@ EMA30 = ${ema30:.2f} 是關鍵支撐。
     
     return f"好的 👍 你有 {shares:,} 股 {ticker}，我幫你依據上面整理的技術面 + 風險控管來給具體操作建議：\n\n{holding_context}\n\n{strategies}\n\n{action_summary}"
 
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """DataFrame 轉 UTF-8 CSV bytes；有 pyarrow 時直接由 C++ writer 輸出"""
+    if HAS_ARROW:
+        buf = pa.BufferOutputStream()
+        pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buf)
+        return buf.getvalue().to_pybytes()
+    return df.to_csv(index=False).encode('utf-8')
+
+def lttb_indices(y, n_out=200):
+    """Largest-Triangle-Three-Buckets 降採樣，回傳要保留的索引（保留首尾與形狀轉折）"""
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    y = np.asarray(y, dtype=np.float64)
+    x = np.arange(n, dtype=np.float64)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    every = (n - 2) / (n_out - 2)
+    a = 0
+    for i in range(n_out - 2):
+        # 下一個 bucket 的平均點
+        s = int(np.floor((i + 1) * every)) + 1
+        e = min(int(np.floor((i + 2) * every)) + 1, n)
+        avg_x, avg_y = x[s:e].mean(), y[s:e].mean()
+        # 目前 bucket 中與前一選點、下一 bucket 平均點構成最大三角形者
+        rs = int(np.floor(i * every)) + 1
+        re = int(np.floor((i + 1) * every)) + 1
+        area = np.abs((x[a] - avg_x) * (y[rs:re] - y[a]) - (x[a] - x[rs:re]) * (avg_y - y[a]))
+        a = rs + int(area.argmax())
+        idx[i + 1] = a
+    return idx
+
 # ----------------- Streamlit UI -----------------
 st.title("📈 自動日報表：最後 5 日K + 詳細綜合解讀（含前因後果）")
 with st.sidebar:
@@ -399,81 +636,92 @@ with st.sidebar:
     
     run_button = st.button("生成報表")
 
+# 已產生的報表存在 session_state：同一 (代號, 區間, 快取時段) 重按時直接重用
+reports = st.session_state.setdefault("reports", {})
 if run_button:
-    with st.spinner("下載資料並計算指標..."):
-        df = download_data(ticker, period=period, interval=interval)
-        if df.empty:
-            st.error("找不到資料或下載失敗，請確認股票代號或網路連線。")
-        else:
-            df = compute_indicators(df)
-            if len(df) < 20:
-                st.warning("資料筆數較少（<20），部分指標可能不足或不精準。")
-            elif len(df) < 10:
-                st.warning("資料筆數過少（<10），前因分析將簡化。")
-            elif len(df) < 3:
-                st.warning("資料筆數過少（<3），MACD 部分分析將簡化。")
-
-            report = generate_detailed_report(df, ticker)
-
-            # Layout: 左：圖，右：綜合解讀
-            col1, col2 = st.columns([2,3])
-
-            with col1:
-                st.subheader("走勢圖與均線")
-                # 優先用 mplfinance 畫 K 線（若使用者勾選且有安裝）
-                if show_candlestick and HAS_MPF:
-                    mpf_df = df[['Open','High','Low','Close_for_calc','Volume']].copy()
-                    mpf_df.rename(columns={'Close_for_calc':'Close'}, inplace=True)
-                    addplots = [
-                        mpf.make_addplot(df['EMA10'], color='orange'),
-                        mpf.make_addplot(df['EMA30'], color='red'),
-                        mpf.make_addplot(df['EMA40'], color='blue')
-                    ]
-                    fig, axlist = mpf.plot(mpf_df, type='candle', style='charles',
-                                           addplot=addplots, volume=True, returnfig=True, figsize=(10,6))
-                    st.pyplot(fig)
-                else:
-                    # fallback: 價格與EMA線 + 成交量條
-                    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10,6), gridspec_kw={'height_ratios':[3,1]})
-                    ax1.plot(df.index, df['Close_for_calc'], label='收盤價', linewidth=1)
-                    ax1.plot(df.index, df['EMA10'], label='EMA10', linewidth=1)
-                    ax1.plot(df.index, df['EMA30'], label='EMA30', linewidth=1)
-                    ax1.plot(df.index, df['EMA40'], label='EMA40', linewidth=1)
-                    ax1.legend(loc='upper left')
-                    ax1.set_title(f"{ticker} 收盤價與EMA")
-                    # volume bars
-                    ax2.bar(df.index, df['Volume'])
-                    ax2.set_title("成交量")
-                    fig.tight_layout()
-                    st.pyplot(fig)
-
-                # allow download last5 as CSV
-                csv_bytes = report['per_candle_df'].to_csv(index=False).encode('utf-8')
-                st.download_button("下載最近5根K之表格（CSV）", data=csv_bytes, file_name=f"{ticker}_last5.csv", mime="text/csv")
-
-            with col2:
-                st.subheader("🔎 詳細綜合解讀")
-                st.markdown(f"**快速結論：** {report['quick_summary']}")
-                st.markdown(f"**指標摘要：** {report['indicators_text']}")
-                st.markdown(f"**RSI 狀態：** {report['rsi_note']}")
-                st.markdown(f"**量能觀察：** {report['volume_note']}")
-                st.markdown(f"**重要價位：** {report['levels_text']}")
-                st.markdown("**綜合說明：**")
-                st.write(report['composite_text'])
-                st.markdown("**具體建議（整合前因後果）**")
-                st.write(report['advice_text'])
-
-            st.subheader("最近 5 根 K 線逐根解讀（含RSI）")
-            st.dataframe(report['per_candle_df'])
-
-            # 新增：持倉操作建議
-            if shares > 0:
-                st.subheader("💼 個性化持倉操作建議")
-                holding_advice = generate_holding_advice(report, shares, cost_price if cost_price > 0 else None)
-                st.markdown(holding_advice)
-
-            st.info("提示：程式使用 'Adj Close'（若有）做指標計算。請記得將停損與倉位依照你的風險承受度調整。新增RSI輔助超買超賣判斷。")
-            st.success("報表產生完成 ✅")
+    report_key = (ticker, period, cache_bucket())
+    if report_key not in reports:
+        with st.spinner("下載資料並計算指標..."):
+            df = load_indicators(ticker, period=period, interval=interval)
+            report = None if df.empty else generate_detailed_report(df, ticker)
+        # 只保留目前快取時段的報表，避免 session_state 持續累積
+        for k in [k for k in reports if k[2] != report_key[2]]:
+            del reports[k]
+        reports[report_key] = (df, report)
+    # 記下按鈕當下的完整鍵；之後調整其他側欄元件時沿用，不因快取時段跨過而讓報表消失
+    st.session_state["active_report"] = report_key
+
+active_report = st.session_state.get("active_report")
+if active_report is not None and active_report[:2] == (ticker, period) and active_report in reports:
+    df, report = reports[active_report]
+    if df.empty:
+        st.error("找不到資料或下載失敗，請確認股票代號或網路連線。")
+    else:
+        if len(df) < 20:
+            st.warning("資料筆數較少（<20），部分指標可能不足或不精準，前因與未來情境分析將略過。")
+        elif len(df) < 10:
+            st.warning("資料筆數過少（<10），前因分析將簡化。")
+        elif len(df) < 3:
+            st.warning("資料筆數過少（<3），MACD 部分分析將簡化。")
+
+        # Layout: 左：圖，右：綜合解讀
+        col1, col2 = st.columns([2,3])
+
+        with col1:
+            st.subheader("走勢圖與均線")
+            # 優先用 mplfinance 畫 K 線（若使用者勾選且有安裝）
+            mpf = _load_mpf() if show_candlestick else None
+            if mpf is not None:
+                # 直接以既有欄位陣列組成 mplfinance 需要的欄名，不複製資料
+                mpf_df = pd.DataFrame({'Open': df['Open'].to_numpy(), 'High': df['High'].to_numpy(),
+                                       'Low': df['Low'].to_numpy(), 'Close': df['Close_for_calc'].to_numpy(),
+                                       'Volume': df['Volume'].to_numpy()}, index=df.index, copy=False)
+                addplots = [
+                    mpf.make_addplot(df['EMA10'], color='orange'),
+                    mpf.make_addplot(df['EMA30'], color='red'),
+                    mpf.make_addplot(df['EMA40'], color='blue')
+                ]
+                fig, axlist = mpf.plot(mpf_df, type='candle', style='charles',
+                                       addplot=addplots, volume=True, returnfig=True, figsize=(10,6))
+                st.pyplot(fig)
+                import matplotlib.pyplot as plt  # mpf 已載入，此處只是取用
+                plt.close(fig)  # mplfinance 經由 pyplot 建圖，需手動釋放
+            else:
+                # fallback: 價格與EMA線 + 成交量條，改用 Streamlit 內建圖表於瀏覽器端繪製，Python 端不必建圖點陣化
+                # 長區間時以 LTTB 降至約 200 點再畫線，形狀不變但傳給前端的資料點大減
+                keep = lttb_indices(df['Close_for_calc'].to_numpy(), n_out=200)
+                st.caption(f"{ticker} 收盤價與EMA")
+                st.line_chart(df[['Close_for_calc', 'EMA10', 'EMA30', 'EMA40']].iloc[keep]
+                              .rename(columns={'Close_for_calc': '收盤價'}))
+                st.caption("成交量")
+                st.bar_chart(df['Volume'], height=150)
+
+            # allow download last5 as CSV
+            st.download_button("下載最近5根K之表格（CSV）", data=report['per_candle_csv'], file_name=f"{ticker}_last5.csv", mime="text/csv")
+
+        with col2:
+            st.subheader("🔎 詳細綜合解讀")
+            st.markdown(f"**快速結論：** {report['quick_summary']}")
+            st.markdown(f"**指標摘要：** {report['indicators_text']}")
+            st.markdown(f"**RSI 狀態：** {report['rsi_note']}")
+            st.markdown(f"**量能觀察：** {report['volume_note']}")
+            st.markdown(f"**重要價位：** {report['levels_text']}")
+            st.markdown("**綜合說明：**")
+            st.write(report['composite_text'])
+            st.markdown("**具體建議（整合前因後果）**")
+            st.write(report['advice_text'])
+
+        st.subheader("最近 5 根 K 線逐根解讀（含RSI）")
+        st.dataframe(report['per_candle_df'])
+
+        # 新增：持倉操作建議
+        if shares > 0:
+            st.subheader("💼 個性化持倉操作建議")
+            holding_advice = generate_holding_advice(report, shares, cost_price if cost_price > 0 else None)
+            st.markdown(holding_advice)
+
+        st.info("提示：程式使用 'Adj Close'（若有）做指標計算。請記得將停損與倉位依照你的風險承受度調整。新增RSI輔助超買超賣判斷。")
+        st.success("報表產生完成 ✅")
 
 # Footer / Notes
 st.markdown("---")